@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Headless acquisition from Trewmac TE300x impedance analysers.
+
+Command line program for unattended runs, e.g. overnight on a server without
+display. Uses only the serial interface in 'trewmac300x_serial.py' and file
+utilities in 'us_utilities.py', no GUI or plotting libraries.
+Each sweep is saved to its own file, same format as from the GUIs.
+
+Example, 100 sweeps, one per minute
+    python acquire_te300x.py --port COM7 --fmin 0.3 --fmax 20 --npts 500 --repeat 100 --interval 60
+
+@author: larsh
+"""
+
+import argparse
+import copy
+import os
+import sys
+import time
+import numpy as np
+import us_utilities as us           # Utilities made for USN ultrasound lab
+import trewmac300x_serial as te     # Serial interface to Trewmac analysers
+import sweep_statistics as stat     # Running mean and std. of repeated sweeps
+import te300x_calibration as tecal  # Open-short-load calibration
+
+#%% Command line arguments
+def parse_arguments( argv=None ):
+    parser = argparse.ArgumentParser( description='Acquire impedance spectra from Trewmac TE300x analyser' )
+    parser.add_argument( '--port',     default='COM7', help="Serial port, or 'replay:<logfile>'" )
+    parser.add_argument( '--fmin',     type=float, default=0.3, help='Start frequency [MHz]' )
+    parser.add_argument( '--fmax',     type=float, default=20,  help='End frequency [MHz]' )
+    parser.add_argument( '--npts',     type=int,   default=500, help='Number of frequency points' )
+    parser.add_argument( '--average',  type=int,   default=16,  help='Averaging in instrument' )
+    parser.add_argument( '--host-average', type=int, default=1, help='Sweeps averaged on computer, 1 for none' )
+    parser.add_argument( '--host-method',  default='sigmaclip', choices=['mean', 'median', 'sigmaclip'],
+                         help='Combination of sweeps averaged on computer' )
+    parser.add_argument( '--output',   type=float, default=100, help='Output level [%%]' )
+    parser.add_argument( '--z0',       type=float, default=50,  help='Reference impedance [Ohm]' )
+    parser.add_argument( '--repeat',   type=int,   default=1,   help='Number of sweeps, 0 to run until stopped' )
+    parser.add_argument( '--interval', type=float, default=0,   help='Time from start of one sweep to the next [s]' )
+    parser.add_argument( '--resultdir',default='results', help='Directory for result files' )
+    parser.add_argument( '--prefix',   default='ZTE', help='Start of result file names' )
+    parser.add_argument( '--timeout',  type=float, default=5, help='Serial port timeout [s]' )
+    parser.add_argument( '--logfile',  default=None, help='Record serial traffic to file, see te300x_replay.py' )
+    parser.add_argument( '--calibration', default=None,
+                         help="Calibration file, or directory to find calibration for frequency range, see te300x_calibration.py" )
+    parser.add_argument( '--benchmark',default=None, metavar='FORMATS',
+                         help="Measure transfer rate for data formats, e.g. 'polZ', comma separated, and exit" )
+    parser.add_argument( '--stats',    action='store_true', help='Report noise, save mean and std. of all sweeps when finished' )
+    parser.add_argument( '--ema',      type=float, default=None, help='Also save exponential average, weight of newest sweep' )
+    return parser.parse_args( argv )
+
+
+#%% Acquisition
+def acquire( args ):
+    analyser  = te.te300x()
+    errorcode = analyser.connect( port=args.port, timeout=args.timeout, logfile=args.logfile )
+    if errorcode == -1:
+        print( f'Error: Could not open {args.port}' )
+        return -1
+    print( f'Connected to {analyser.read_version()}, {analyser.res.baudrate} baud' )
+    analyser.set_frequencyrange( args.fmin*1e6, args.fmax*1e6, args.npts )
+    average = analyser.set_averaging( args.average )
+    output  = analyser.set_output( args.output )
+    z0      = analyser.set_z0( args.z0 )
+    res     = analyser.res
+    print( f'frange = {res.fmin/1e6:.2f} ... {res.fmax/1e6:.2f} MHz, {res.npts:4d} pts, '   # Analyser confirms in Hz
+           f'average = {average:3d}, Output = {output:.0f} %, Z0 = {z0:.1f} Ohm' )
+    if args.calibration is not None:
+        f = np.linspace( res.fmin, res.fmax, res.npts )   # Hz, as confirmed by analyser
+        if os.path.isdir( args.calibration ):
+            analyser.calibration = tecal.find_calibration( f, args.calibration, z0=z0 )
+        else:
+            analyser.calibration = tecal.te300x_calibration()
+            try:
+                analyser.calibration.load( args.calibration )
+            except ( OSError, KeyError, ValueError ) as error:
+                print( f'Error: Could not read calibration {args.calibration}, {error}' )
+                analyser.close()
+                return -1
+        if analyser.calibration is None:
+            print( f'Error: No calibration for this frequency range and Z0 in {args.calibration}' )
+            analyser.close()
+            return -1
+        if not analyser.calibration.matches_z0( z0 ):
+            print( f'Error: Calibration recorded with Z0 = {analyser.calibration.z0:.1f} Ohm, analyser uses {z0:.1f} Ohm' )
+            analyser.close()
+            return -1
+        print( f'Calibration {args.calibration}' )
+    if args.host_average > 1:
+        print( f'Averaging {args.host_average} sweeps on computer, {args.host_method}' )
+
+    if args.benchmark is not None:
+        benchmark( analyser, args.benchmark.split(',') )
+        analyser.close()
+        return 0
+
+    statistics = stat.sweep_statistics( alpha=args.ema )
+    n_sweep = 0
+    n_saved = 0
+    t_first = time.perf_counter()
+    try:
+        while args.repeat == 0 or n_sweep < args.repeat:
+            t_sweep = time.perf_counter()
+            if args.host_average > 1:
+                errorcode = analyser.read_sweep_host_averaged( args.host_average, args.host_method )   # Also reconnects
+            else:
+                errorcode = analyser.read_sweep_robust()   # Reconnects if connection is lost
+            t_read  = time.perf_counter() - t_sweep
+            n_sweep += 1
+            if errorcode == -1:
+                print( f'{n_sweep:5d}  Sweep lost, {analyser.n_lost} lost in total. Connected: {analyser.connected}' )
+            else:
+                [ resultfile, resultpath ] = us.find_filename( prefix=args.prefix, ext='trc', resultdir=args.resultdir )
+                us.save_impedance_result( resultpath, analyser.res )
+                n_saved += 1
+                rate = n_sweep / ( time.perf_counter() - t_first )
+                n_read  = analyser.res.nf * analyser.res.host_averaging   # Points read from analyser
+                message = ( f'{n_sweep:5d}  {resultfile}  {n_read:5d} pts in {t_read:.2f} s  '
+                            f'({n_read/t_read:.0f} pts/s, {rate*60:.1f} sweeps/min)' )
+                if args.host_average > 1:
+                    message += f'  noise floor {100*np.nanmedian( analyser.res.noise ):.3f} %'
+                if args.stats:
+                    statistics.add_result( analyser.res )
+                    [ noise_mag, noise_phase ] = statistics.noise()
+                    message += f'  noise {100*noise_mag:.3f} %, {np.degrees(noise_phase):.3f} Deg'
+                print( message )
+            t_wait = args.interval - ( time.perf_counter() - t_sweep )
+            if t_wait > 0 and ( args.repeat == 0 or n_sweep < args.repeat ):
+                time.sleep( t_wait )
+    except KeyboardInterrupt:
+        print( 'Stopped' )
+    finally:
+        analyser.close()
+    if n_saved < n_sweep:
+        print( f'{n_saved} of {n_sweep} sweeps saved, {n_sweep-n_saved} lost' )
+    if args.stats and statistics.n_sweeps > 0:
+        save_statistics( statistics, analyser.res, args )
+    return 0
+
+
+"""
+Measure and print transfer rate for data formats at baud rate in use.
+Line limit is maximum points/s with 10 bits per byte on the serial line
+"""
+def benchmark( analyser, formats, n_sweeps=3 ):
+    baudrate = analyser.res.baudrate
+    print( f'Baud rate {baudrate}' )
+    print( 'Format   bytes/pt    pts/s  line limit pts/s' )
+    for dataformat, bytes_per_point, points_per_s, bytes_per_s in analyser.measure_throughput( formats, n_sweeps ):
+        print( f'{dataformat:8s} {bytes_per_point:8.1f} {points_per_s:8.0f} {baudrate/10/bytes_per_point:10.0f}' )
+    return 0
+
+
+"""
+Save statistics as impedance results, one file each for mean, std. and
+exponential average. Same format as single sweeps
+"""
+def save_statistics( statistics, res, args ):
+    results = { 'mean': statistics.mean, 'std': statistics.std() }
+    if args.ema is not None:
+        results['ema'] = statistics.ema
+    for name, Z in results.items():
+        stat_res   = copy.copy( res )
+        stat_res.f = statistics.f
+        stat_res.Z = Z
+        [ resultfile, resultpath ] = us.find_filename( prefix=f'{args.prefix}_{name}', ext='trc', resultdir=args.resultdir )
+        us.save_impedance_result( resultpath, stat_res )
+        print( f'{name} of {statistics.n_sweeps} sweeps saved to {resultfile}' )
+    return 0
+
+
+#%% Main function
+if __name__ == "__main__":
+    sys.exit( acquire( parse_arguments() ) )
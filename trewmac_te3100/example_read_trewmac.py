@@ -47,7 +47,7 @@ frange_ok = analyser.set_frequencyrange( fmin, fmax, npts )
 avg       = analyser.set_averaging ( avg )
 output    = analyser.set_output ( output )
 z0        = analyser.set_z0 ( z0 )
-sweep_ok  = analyser.read_sweep()
+sweep_ok  = analyser.read_sweep_point_by_point()
 
 res = analyser.res
 
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Resample impedance sweeps to common frequency points, for comparing sweeps
+measured with different frequency ranges or number of points.
+
+Interpolation is done on complex impedance, Z=|Z|*exp(j*arg(Z)), linear in
+frequency or in log(frequency). Interpolation weights depend only on the
+source and target frequencies, and are cached for each pair. All sweeps on
+the same source frequencies are resampled in one vectorised operation.
+Points outside the source range are NaN, no extrapolation.
+
+Impedance arrays use the layout of te_result.Z, [npts, 2] as [Zmag, Zphase],
+or [n_sweeps, npts, 2] for several sweeps.
+
+@author: larsh
+"""
+
+import numpy as np
+import us_utilities as us           # Conversion between polar and complex impedance, loading results
+
+max_cache = 64        # Number of weight sets kept
+weight_cache = {}
+
+#%% Frequency grids
+def frequency_grid( fmin, fmax, npts, spacing='linear' ):
+    if spacing.lower() == 'log':
+        return np.geomspace( fmin, fmax, npts )
+    return np.linspace( fmin, fmax, npts )
+
+
+#%% Interpolation weights
+"""
+Weights for linear interpolation from f_source to f_target. Returns index of
+point below, and weight of point above, for each target frequency. Cached
+"""
+def interpolation_weights( f_source, f_target, spacing='linear' ):
+    f_source = np.asarray( f_source, dtype=float )
+    f_target = np.asarray( f_target, dtype=float )
+    key = ( f_source.tobytes(), f_target.tobytes(), spacing )
+    if key in weight_cache:
+        return weight_cache[key]
+    if spacing.lower() == 'log':
+        x_source = np.log( f_source )
+        x_target = np.log( f_target )
+    else:
+        x_source = f_source
+        x_target = f_target
+    n = np.clip( np.searchsorted( x_source, x_target, side='right' ) - 1, 0, len( x_source ) - 2 )
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        w = ( x_target - x_source[n] )/( x_source[n+1] - x_source[n] )
+    w[ ( x_target < x_source[0] ) | ( x_target > x_source[-1] ) ] = np.nan
+    if len( weight_cache ) >= max_cache:
+        weight_cache.pop( next( iter( weight_cache ) ) )   # Remove oldest
+    weight_cache[key] = [ n, w ]
+    return [ n, w ]
+
+"""
+Interpolate values along axis from f_source to f_target, e.g. complex values
+"""
+def interpolate( f_source, values, f_target, spacing='linear', axis=0 ):
+    [ n, w ] = interpolation_weights( f_source, f_target, spacing )
+    values = np.asarray( values )
+    shape  = [1]*values.ndim
+    shape[axis] = len( w )
+    w = w.reshape( shape )
+    return np.take( values, n, axis=axis )*( 1-w ) + np.take( values, n+1, axis=axis )*w
+
+
+#%% Resample impedance
+"""
+Resample impedance Z, [npts, 2] or [n_sweeps, npts, 2], measured at f_source
+"""
+def resample( f_source, Z, f_target, spacing='linear' ):
+    Zc = us.polar_to_complex( np.asarray( Z ) )
+    Zc = interpolate( f_source, Zc, f_target, spacing, axis=-1 )
+    return us.complex_to_polar( Zc )
+
+"""
+Align sweeps with different frequencies, sweeps as list of [f, Z].
+Target frequencies default to the range covered by all sweeps, with the
+highest number of points. Returns f_target and Z as [n_sweeps, npts, 2]
+"""
+def align_sweeps( sweeps, f_target=None, spacing='linear' ):
+    if f_target is None:
+        fmin = max( f[0]  for f, Z in sweeps )
+        fmax = min( f[-1] for f, Z in sweeps )
+        npts = max( len(f) for f, Z in sweeps )
+        f_target = frequency_grid( fmin, fmax, npts, spacing )
+    Z_aligned = np.full( ( len( sweeps ), len( f_target ), 2 ), np.nan )
+
+    groups = {}      # Sweeps with same frequencies, resampled together
+    for k, ( f, Z ) in enumerate( sweeps ):
+        groups.setdefault( np.asarray( f, dtype=float ).tobytes(), [] ).append( k )
+    for members in groups.values():
+        f = np.asarray( sweeps[ members[0] ][0], dtype=float )
+        Z = np.stack( [ sweeps[k][1] for k in members ] )
+        Z_aligned[members] = resample( f, Z, f_target, spacing )
+    return [ f_target, Z_aligned ]
+
+"""
+Load result files saved by 'save_impedance_result' and align them
+"""
+def align_files( paths, f_target=None, spacing='linear' ):
+    sweeps = []
+    for path in paths:
+        res = us.load_impedance_result( path )
+        sweeps.append( [ res.f, res.Z ] )
+    return align_sweeps( sweeps, f_target, spacing )
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Fast live display of impedance spectra, |Z| and arg(Z) vs. frequency.
+
+Used by the Trewmac GUIs. Two plot backends with the same methods
+    impedance_graph            matplotlib. Axes, grids and ticks are drawn
+                               once and cached, only the two lines are redrawn
+                               ('blitting') when data are updated
+    impedance_graph_pyqtgraph  pyqtgraph, if installed. Faster for large npts
+
+Updates are limited to 'max_rate' frames per second. Calls in between are
+skipped unless forced, so the display does not slow down acquisition.
+
+@author: larsh
+"""
+
+import time
+import numpy as np
+
+#%% Select backend
+"""
+Create graph using named backend, 'matplotlib' or 'pyqtgraph'.
+Falls back to matplotlib if pyqtgraph is not installed.
+Plotting libraries are imported here, not when this module is imported
+"""
+def create_graph( backend='matplotlib', max_rate=30, mpl_backend=None ):
+    if backend.lower() == 'pyqtgraph':
+        try:
+            return impedance_graph_pyqtgraph( max_rate=max_rate )
+        except ImportError:
+            pass
+    return impedance_graph( max_rate=max_rate, mpl_backend=mpl_backend )
+
+
+#%% matplotlib with blitting
+class impedance_graph:
+    def __init__( self, max_rate=30, mpl_backend=None ):
+        import matplotlib
+        if mpl_backend:      # E.g. 'Qt5Agg' when used in Qt GUI
+            matplotlib.use( mpl_backend )
+        import matplotlib.pyplot as plt
+        self.plt = plt
+        fig, axs = plt.subplots( nrows=2, ncols=1, figsize=(8, 12) )
+        for k in range( 0, 2):   # Common for both subplots
+            axs[k].set_xlabel('Frequency [MHz]')
+            axs[k].set_xlim(0 , 20)
+            axs[k].grid( True )
+        axs[0].set_yscale( 'log' )
+        axs[0].grid( visible=True, which='minor', axis='y' )
+        axs[0].set_ylabel('|Z| [Ohm]')
+        axs[1].set_ylabel('arg(Z) [Deg]')
+        axs[0].set_ylim( 1, 1e6 )
+        axs[1].set_ylim( -90, 90 )
+
+        # Handles to datapoints, empty so far. Drawn separately from the static background
+        self.lines = [ axs[0].plot( [], [], animated=True )[0],
+                       axs[1].plot( [], [], animated=True )[0] ]
+        self.fig  = fig
+        self.axs  = axs
+        self.background = None
+        self.min_interval = 1/max_rate
+        self.t_last = 0.0
+        fig.canvas.mpl_connect( 'draw_event', self.on_draw )
+        fig.show()
+
+    def on_draw( self, event ):   # Full redraw, e.g. resize or new scale. Cache the static background
+        canvas = self.fig.canvas
+        self.background = canvas.copy_from_bbox( self.fig.bbox )
+        for k in range( 0, 2):
+            self.axs[k].draw_artist( self.lines[k] )
+        return 0
+
+    def update( self, f, Zmag, Zphase, force=False ):
+        """ Update lines. f in Hz, Zmag in Ohm, Zphase in degrees """
+        t = time.perf_counter()
+        if not force and ( t - self.t_last ) < self.min_interval:
+            return 0
+        self.t_last = t
+        self.lines[0].set_data( f/1e6, Zmag )
+        self.lines[1].set_data( f/1e6, Zphase )
+        canvas = self.fig.canvas
+        if self.background is None:
+            self.redraw()
+        else:
+            canvas.restore_region( self.background )
+            for k in range( 0, 2):
+                self.axs[k].draw_artist( self.lines[k] )
+            canvas.blit( self.fig.bbox )
+            canvas.flush_events()
+        return 0
+
+    def redraw( self ):
+        self.fig.canvas.draw()
+        self.fig.canvas.flush_events()
+        return 0
+
+    def set_f_scale( self, fmin, fmax ):   # Frequencies in MHz
+        self.axs[0].set_xlim( fmin, fmax )
+        self.axs[1].set_xlim( fmin, fmax )
+        return self.redraw()
+
+    def set_Z_scale( self, Zmin, Zmax ):
+        self.axs[0].set_ylim( Zmin, Zmax )
+        return self.redraw()
+
+    def close( self ):
+        self.plt.close( self.fig )
+        return 0
+
+
+#%% pyqtgraph
+class impedance_graph_pyqtgraph:
+    def __init__( self, max_rate=30 ):
+        import pyqtgraph as pg   # Optional, raises ImportError if not installed
+        win = pg.GraphicsLayoutWidget( title='Impedance' )
+        win.resize( 800, 1000 )
+        axs = [ win.addPlot( row=0, col=0 ), win.addPlot( row=1, col=0 ) ]
+        for k in range( 0, 2):
+            axs[k].setLabel( 'bottom', 'Frequency [MHz]' )
+            axs[k].showGrid( x=True, y=True )
+            axs[k].setXRange( 0, 20 )
+        axs[0].setLogMode( y=True )
+        axs[0].setLabel( 'left', '|Z| [Ohm]' )
+        axs[1].setLabel( 'left', 'arg(Z) [Deg]' )
+        axs[0].setYRange( 0, 6 )   # Log-scale, set as exponents
+        axs[1].setYRange( -90, 90 )
+
+        self.lines = [ axs[0].plot( [], [] ), axs[1].plot( [], [] ) ]
+        self.win  = win
+        self.axs  = axs
+        self.min_interval = 1/max_rate
+        self.t_last = 0.0
+        win.show()
+
+    def update( self, f, Zmag, Zphase, force=False ):
+        """ Update lines. f in Hz, Zmag in Ohm, Zphase in degrees """
+        t = time.perf_counter()
+        if not force and ( t - self.t_last ) < self.min_interval:
+            return 0
+        self.t_last = t
+        valid = np.isfinite( f )
+        self.lines[0].setData( f[valid]/1e6, Zmag[valid] )
+        self.lines[1].setData( f[valid]/1e6, Zphase[valid] )
+        return self.redraw()
+
+    def redraw( self ):
+        import pyqtgraph as pg
+        pg.QtWidgets.QApplication.processEvents()
+        return 0
+
+    def set_f_scale( self, fmin, fmax ):   # Frequencies in MHz
+        self.axs[0].setXRange( fmin, fmax, padding=0 )
+        self.axs[1].setXRange( fmin, fmax, padding=0 )
+        return 0
+
+    def set_Z_scale( self, Zmin, Zmax ):
+        self.axs[0].setYRange( np.log10(Zmin), np.log10(Zmax), padding=0 )
+        return 0
+
+    def close( self ):
+        self.win.close()
+        return 0
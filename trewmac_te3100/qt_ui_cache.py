@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Load GUI definitions made in Qt Designer without parsing the .ui-file at
+every program start.
+
+The .ui-file is compiled to Python once, to '<name>_ui.py' in the same
+directory, and recompiled only when the .ui-file is newer. Importing the
+compiled module is much faster than 'uic.loadUiType'. It is written to a
+temporary file first, so an interrupted compilation leaves no broken module.
+
+@author: larsh
+"""
+
+import os
+import importlib.util
+
+"""
+Return the form class defined in 'uifile', e.g. 'Ui_MainWindow'.
+Relative paths are taken from the directory of this file
+"""
+def load_ui_class( uifile ):
+    if not os.path.isabs( uifile ):
+        uifile = os.path.join( os.path.dirname( os.path.abspath(__file__) ), uifile )
+    pyfile = os.path.splitext( uifile )[0] + '_ui.py'
+    try:
+        if not os.path.isfile( pyfile ) or os.path.getmtime( pyfile ) < os.path.getmtime( uifile ):
+            from PyQt5 import uic   # Only needed when compiling
+            tmpfile = f'{pyfile}.{os.getpid()}.tmp'   # Complete file replaces old, never a truncated one
+            try:
+                with open( tmpfile, 'wt', encoding='utf-8' ) as fid:
+                    uic.compileUi( uifile, fid )
+                os.replace( tmpfile, pyfile )
+            finally:
+                if os.path.exists( tmpfile ):
+                    os.remove( tmpfile )
+    except OSError:      # Directory not writeable, parse .ui-file directly
+        from PyQt5 import uic
+        form_class, base_class = uic.loadUiType( uifile )
+        return form_class
+
+    name   = os.path.splitext( os.path.basename( pyfile ) )[0]
+    spec   = importlib.util.spec_from_file_location( name, pyfile )
+    module = importlib.util.module_from_spec( spec )
+    spec.loader.exec_module( module )
+    form_class = [ getattr( module, c ) for c in dir( module ) if c.startswith( 'Ui_' ) ]
+    return form_class[0]
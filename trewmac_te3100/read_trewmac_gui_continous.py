@@ -16,16 +16,22 @@ Results are read and saved as frequency, abs(Z) and arg(Z), where Z(f) is comple
 """
 
 #%% Libraries
+import time
+t_start = time.perf_counter()       # Measure program startup time
 import sys
-from PyQt5 import QtWidgets, uic
-import matplotlib.pyplot as plt     # For plotting
-import matplotlib                   # For setup with Qt
+from PyQt5 import QtWidgets
+import impedance_plot as zplot      # Fast live display of impedance spectra, imports plotting libraries when used
+import qt_ui_cache                  # GUI from Qt Designer, compiled once
+import numpy as np
 import us_utilities as us           # Utilities made fro USN ultrasound lab
+import sweep_statistics as stat     # Running mean and std. of repeated sweeps
+import te300x_calibration as tecal  # Open-short-load calibration
 import trewmac300x_serial as te     # Serial inerface to Trewmac analysers
 
 #%% Set up GUI from Qt5
-matplotlib.use('Qt5Agg')
-analyser_main_window, QtBaseClass = uic.loadUiType('read_trewmac_gui.ui')
+analyser_main_window = qt_ui_cache.load_ui_class('read_trewmac_gui.ui')
+plot_backend   = 'matplotlib'      # 'matplotlib' (blitting) or 'pyqtgraph' (if installed)
+startup_budget = 1.0               # s  Warn if program takes longer to open
 
 
 class acquisition_control:  
@@ -43,6 +49,7 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
         # Initialise instrument
         self.runstate = acquisition_control()
         self.analyser = te.te300x()
+        self.statistics = stat.sweep_statistics()
         
         # Connect GUI elements
         self.fmin_SpinBox.valueChanged.connect( self.set_frequency_range )
@@ -60,26 +67,14 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
         self.save_button.clicked.connect( self.save_results ) 
         self.stop_button.clicked.connect( self.stop_acquisition ) 
         self.close_button.clicked.connect( self.close_app ) 
-        
-        # Initialise result graph
-        #plt.ion()         # Does not seem to make any difference
-        fig, axs = plt.subplots( nrows=2, ncols=1, figsize=(8, 12) )       
-        for k in range( 0, 2):   # Commpn for both subplots
-            axs[k].set_xlabel('Frequency [MHz]')
-            axs[k].set_xlim(0 , 20)   
-            axs[k].grid( True )              
-        axs[0].grid( visible=True, which='minor', axis='y' )
-        axs[0].set_ylabel('|Z| [Ohm]')
-        axs[1].set_ylabel('arg(Z) [Deg]')       
-        axs[0].set_ylim( 1, 1e6 )
-        axs[1].set_ylim( -90, 90 )
 
-        # Create handle to datapoints, empty so far
-        graphs=[ axs[0].semilogy( [], [] )[0], axs[1].plot( [], [] )[0] ]         
-        fig.show()        
-        self.graph= graphs
-        self.axs  = axs
-        self.fig  = fig      
+        # Calibration menu, see 'te300x_calibration.py'
+        calibration_menu = self.menubar.addMenu( 'Calibration' )
+        calibration_menu.addAction( 'Load ...', self.load_calibration )
+        calibration_menu.addAction( 'Remove', self.remove_calibration )
+        
+        # Result graph created when analyser is connected, see 'show_graph'
+        self.graph = None
 
         # Initialise GUI with messages         
         self.enable_controls( state=False, active='connect' )                
@@ -89,7 +84,8 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
     #%% Program run 
     def close_app(self):
         self.statusBar().showMessage( 'Closing' )
-        plt.close(self.fig)
+        if self.graph is not None:
+            self.graph.close()
         try:
             self.analyser.close()
             errorcode = 0
@@ -180,6 +176,7 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
             self.set_output( )
             ver = self.analyser.read_version()
             self.update_status( f'Version {ver}\n', append=True)           
+            self.show_graph()
             self.portstatus_Edit.setText( 'Connected' ) 
             self.enable_controls( state=True, active='control' )
             self.statusBar().showMessage( 'Analyser connected' )
@@ -214,33 +211,78 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
         z0 = self.analyser.set_z0 ( z0 )
         self.update_status( f'Z0 = {z0:.1f} Ohm\n', append=True )
         self.statusBar().showMessage( f'Reference inpedance changed to {z0:.1f} Ohm' )        
+        calibration = self.analyser.calibration
+        if calibration is not None and not calibration.matches_z0( z0 ):
+            self.remove_calibration()
+            self.update_status( f'Calibration removed, recorded with Z0 = {calibration.z0:.1f} Ohm\n', append=True )
         return z0
 
+    def load_calibration( self ):
+        [ path, selected ] = QtWidgets.QFileDialog.getOpenFileName( self, 'Load calibration', 'calibration', 'Calibration (*.npz)' )
+        if not path:
+            return 0
+        calibration = tecal.te300x_calibration()
+        try:
+            calibration.load( path )
+        except ( OSError, KeyError, ValueError ):
+            self.statusBar().showMessage( f'Could not read calibration {path}' )
+            return -1
+        z0 = self.z0_SpinBox.value()
+        if not calibration.matches_z0( z0 ):   # Analyser calculates Z from its Zo
+            self.update_status( f'Calibration not loaded, recorded with Z0 = {calibration.z0:.1f} Ohm, not {z0:.1f} Ohm\n', append=True )
+            self.statusBar().showMessage( 'Calibration not loaded, different Z0' )
+            return -1
+        self.analyser.calibration = calibration
+        self.statistics.reset()
+        self.update_status( f'Calibration {path}\n', append=True )
+        self.statusBar().showMessage( 'Calibration loaded' )
+        return 0
+
+    def remove_calibration( self ):
+        self.analyser.calibration = None
+        self.statistics.reset()
+        self.statusBar().showMessage( 'Calibration removed' )
+        return 0
+
     def acquire_trace( self ):
         self.resultfile_Edit.setText('Not saved')        
         self.runstate.finished = False
+        self.statistics.reset()
+        self.show_graph()
         self.enable_controls( state=False, active='scale' )       
         self.update_status_box( 'acquisition', 'Acquiring', 'green', 'white'  )
         while not( self.runstate.finished):
             self.statusBar().showMessage( 'Reading data from analyser' )        
             self.update_status( 'Reading data from analyser ... \n', append=True )
-            self.analyser.read_sweep_point_by_point( self.graph , self.fig )
-            self.update_status( 'Finished\n', append=True )                
-            self.fig.canvas.draw()          # --- TRY: Probably not sufficient
-            self.fig.canvas.flush_events()  # --- TRY: Probably good            
+            errorcode = self.analyser.read_sweep_robust( self.graph )   # Reconnects if connection is lost
+            if errorcode == -1:
+                self.update_status( f'Sweep lost, {self.analyser.n_lost} in total\n', append=True )
+                if not self.analyser.connected:
+                    self.update_status_box( 'connection', 'Connection lost', 'red', 'white' )
+            else:
+                self.update_status_box( 'connection', 'Connected', 'green', 'white' )
+                self.statistics.add_result( self.analyser.res )
+                [ noise_mag, noise_phase ] = self.statistics.noise()
+                self.update_status( f'Finished. Noise |Z| {100*noise_mag:.3f} %, arg(Z) {np.degrees(noise_phase):.3f} Deg, {self.statistics.n_sweeps} sweeps\n', append=True )
+            QtWidgets.QApplication.processEvents()   # Keep GUI responsive, e.g. to Stop-button
         self.statusBar().showMessage( 'Reading from analyser finished' )     
         self.enable_controls( state=True, active='control' )
         self.update_status_box( 'acquisition', 'Finished'  )
         return 0
 
+    def show_graph( self ):   # Create result graph when first needed, slow to import and draw
+        if self.graph is None:
+            self.graph = zplot.create_graph( plot_backend, mpl_backend='Qt5Agg' )
+            self.set_f_scale()
+            self.set_Z_scale()
+        return 0
+
     def set_f_scale( self ):
         fmin = self.fscalemin_SpinBox.value()
         fmax = self.fscalemax_SpinBox.value()
         if fmin<fmax:
-            self.axs[0].set_xlim( fmin, fmax )
-            self.axs[1].set_xlim( fmin, fmax )            
-            self.fig.canvas.draw()
-            self.fig.canvas.flush_events()  
+            if self.graph is not None:
+                self.graph.set_f_scale( fmin, fmax )
             self.statusBar().showMessage( 'Frequency axis changed' ) 
         return 0
         
@@ -249,9 +291,8 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
         Zmin = self.read_scaled_value ( Zstr )
         Zmax = self.read_scaled_value ( self.Zscalemax_comboBox.currentText() )
         if Zmin<Zmax:
-            self.axs[0].set_ylim( Zmin, Zmax )        
-            self.fig.canvas.draw()
-            self.fig.canvas.flush_events()        
+            if self.graph is not None:
+                self.graph.set_Z_scale( Zmin, Zmax )
             self.statusBar().showMessage( 'Impedance axis changed' ) 
         return 0
 
@@ -260,4 +301,8 @@ if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
     window = read_analyser()
     window.show()
+    t_startup = time.perf_counter() - t_start
+    if t_startup > startup_budget:
+        print( f'Warning: Startup took {t_startup:.2f} s, budget is {startup_budget:.2f} s' )
+    window.statusBar().showMessage( f'Program started in {t_startup:.2f} s' )
     sys.exit(app.exec_())
@@ -16,15 +16,19 @@ Results are read and saved as frequency, abs(Z) and arg(Z), where Z(f) is comple
 """
 
 #%% Libraries
+import time
+t_start = time.perf_counter()       # Measure program startup time
 import sys
-from PyQt5 import QtWidgets, uic
-import matplotlib.pyplot as plt     # For plotting
-import matplotlib                   # For setup with Qt
+import numpy as np
+from PyQt5 import QtWidgets
+import impedance_plot as zplot      # Fast live display of impedance spectra, imports plotting libraries when used
+import qt_ui_cache                  # GUI from Qt Designer, compiled once
 import trewmac300x_serial as te     # Serial inerface to Trewmac analysers
 
 #%% Set up GUI from Qt5
-matplotlib.use('Qt5Agg')
-analyser_main_window, QtBaseClass = uic.loadUiType('read_trewmac_gui.ui')
+analyser_main_window = qt_ui_cache.load_ui_class('read_trewmac_gui.ui')
+plot_backend   = 'matplotlib'      # 'matplotlib' (blitting) or 'pyqtgraph' (if installed)
+startup_budget = 1.0               # s  Warn if program takes longer to open
 
 #%% Class and defs
 class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
@@ -49,28 +53,8 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
         self.save_button.clicked.connect( self.save_results ) 
         self.close_button.clicked.connect( self.close_app ) 
         
-        # Initialise result graph
-        #plt.ion()         # Does not seem to make any difference
-        fig, axs = plt.subplots( nrows=2, ncols=1, figsize=(8, 12) )       
-        for k in range( 0, 2):   # Commpn for both subplots
-            axs[k].set_xlabel('Frequency [MHz]')
-            axs[k].set_xlim(0 , 20)   
-            axs[k].grid( True )   
-            
-        axs[0].grid( visible=True, which='minor', axis='y' )
-        axs[0].set_ylabel('|Z| [Ohm]')
-        axs[1].set_ylabel('arg(Z) [Deg]')       
-        axs[0].set_ylim( 1, 1e6 )
-        axs[1].set_ylim( -90, 90 )
-
-        # Create handle to datapoints, empty so far
-        graphs=[ axs[0].semilogy( [], [] )[0], axs[1].plot( [], [] )[0] ] 
-        
-        fig.show()
-        
-        self.graph= graphs
-        self.axs  = axs
-        self.fig  = fig               
+        # Result graph created when analyser is connected, see 'show_graph'
+        self.graph = None
 
         # Initialise instrument
         self.analyser = te.te300x()
@@ -96,6 +80,7 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
             self.set_output( )
             ver = self.analyser.read_version()
             self.update_status( f'Version {ver}\n', append=True)           
+            self.show_graph()
             self.portstatus_Edit.setText( 'Connected' )  
             self.main_tabWidget.setTabEnabled(0, True )
             self.main_tabWidget.setTabEnabled(1, True )
@@ -103,7 +88,8 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
         return errorcode 
         
     def close_app(self):
-        plt.close(self.fig)
+        if self.graph is not None:
+            self.graph.close()
         try:
             self.analyser.close()
             errorcode = 0
@@ -175,9 +161,9 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
         self.update_status( 'Reading data from analyser ... \n', append=True )
         self.resultfile_Edit.setText('Not saved') 
 
-        self.analyser.read_sweep()
+        self.analyser.read_sweep_point_by_point()
         f   = self.analyser.res.f
-        Zmag= self.analyser.res.Zmag
+        Zmag= self.analyser.res.Z[:,0]
         
         self.update_status( 'Finished\n', append=True )
         self.update_status( f'f[0]={f[0]/1e6:.2f} MHz, Zmag[0]={Zmag[0]:.2f} Ohm  \n', append=True )
@@ -188,24 +174,25 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
     def plot_graph(self):    
         self.update_status( 'Plotting graph\n', append=True )        
         f     = self.analyser.res.f
-        Zmag  = self.analyser.res.Zmag
-        Zphase= self.analyser.res.Zphase
-        self.graph[0].set_xdata( f/1e6 )
-        self.graph[0].set_ydata( Zmag ) 
-        self.graph[1].set_xdata( f/1e6 )
-        self.graph[1].set_ydata( Zphase ) 
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+        Zmag  = self.analyser.res.Z[:,0]
+        Zphase= np.degrees( self.analyser.res.Z[:,1] )   # Phase is saved as radians but plotted as degrees
+        self.show_graph()
+        self.graph.update( f, Zmag, Zphase, force=True )
         return 0        
 
+    def show_graph( self ):   # Create result graph when first needed, slow to import and draw
+        if self.graph is None:
+            self.graph = zplot.create_graph( plot_backend, mpl_backend='Qt5Agg' )
+            self.set_f_scale()
+            self.set_Z_scale()
+        return 0
+
     def set_f_scale( self ):
         fmin = self.fscalemin_SpinBox.value()
         fmax = self.fscalemax_SpinBox.value()
         if fmin<fmax:
-            self.axs[0].set_xlim( fmin, fmax )
-            self.axs[1].set_xlim( fmin, fmax )            
-            self.fig.canvas.draw()
-            self.fig.canvas.flush_events()        
+            if self.graph is not None:
+                self.graph.set_f_scale( fmin, fmax )
         return 0
         
     def set_Z_scale( self ):
@@ -213,9 +200,8 @@ class read_analyser(QtWidgets.QMainWindow, analyser_main_window):
         Zmin = self.read_scaled_value ( Zstr )
         Zmax = self.read_scaled_value ( self.Zscalemax_comboBox.currentText() )
         if Zmin<Zmax:
-            self.axs[0].set_ylim( Zmin, Zmax )        
-            self.fig.canvas.draw()
-            self.fig.canvas.flush_events()        
+            if self.graph is not None:
+                self.graph.set_Z_scale( Zmin, Zmax )
         return 0
 
 
@@ -224,4 +210,8 @@ if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
     window = read_analyser()
     window.show()
+    t_startup = time.perf_counter() - t_start
+    if t_startup > startup_budget:
+        print( f'Warning: Startup took {t_startup:.2f} s, budget is {startup_budget:.2f} s' )
+    window.statusBar().showMessage( f'Program started in {t_startup:.2f} s' )
     sys.exit(app.exec_())
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Average several impedance sweeps on the computer, with outlier rejection.
+
+Alternative to averaging in the instrument: Read several fast sweeps with low
+averaging and combine them here. Glitches in single sweeps can be rejected,
+which instrument averaging cannot do.
+
+Sweeps are combined as complex impedance, Z=|Z|*exp(j*arg(Z)), not as
+magnitude and phase separately. Averaging magnitudes is biased by noise.
+
+Methods
+    'mean'       Plain average
+    'median'     Median of real and imaginary parts separately
+    'sigmaclip'  Average after iteratively removing values further than
+                 n_sigma standard deviations from the median. Standard
+                 deviation estimated from median distance to the median
+
+@author: larsh
+"""
+
+import numpy as np
+import us_utilities as us           # Conversion between polar and complex impedance
+
+rms_from_median = np.sqrt( 1/np.log(2) )   # RMS/median of |complex Gaussian noise|, Rayleigh distribution
+median_efficiency = np.sqrt( np.pi/2 )      # Std. of median/std. of mean, Gaussian noise, many sweeps
+
+#%% Combine sweeps
+"""
+Combine sweeps, Z as array [n_sweeps, npts, 2] of [Zmag, Zphase].
+Returns combined Z [npts, 2] and relative noise per point, estimated standard
+deviation of the combined Z relative to |Z|
+"""
+def combine_sweeps( Z, method='sigmaclip', n_sigma=3.0, n_iter=3 ):
+    Zc    = us.polar_to_complex( np.asarray( Z ) )
+    valid = np.isfinite( Zc )
+    if method.lower() == 'mean':
+        Zavg = np.nanmean( Zc, axis=0 )
+    elif method.lower() == 'median':
+        Zavg = complex_median( Zc )
+    elif method.lower() == 'sigmaclip':
+        for k in range( n_iter ):
+            centre = complex_median( np.where( valid, Zc, np.nan ) )
+            dev    = np.abs( Zc - centre )
+            sigma  = rms_from_median * np.nanmedian( np.where( valid, dev, np.nan ), axis=0 )   # Robust against the outliers
+            keep   = np.isfinite( Zc ) & ( dev <= n_sigma*sigma )
+            if np.array_equal( keep, valid ):
+                break
+            valid = keep
+        Zavg = np.nanmean( np.where( valid, Zc, np.nan ), axis=0 )
+    else:
+        raise ValueError( f'Unknown averaging method {method}' )
+
+    n_used = np.sum( valid, axis=0 )
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        if method.lower() == 'median':   # Outliers are kept in valid, use robust spread
+            sigma = rms_from_median * np.nanmedian( np.where( valid, np.abs( Zc - Zavg ), np.nan ), axis=0 )
+            sigma = sigma * median_efficiency
+        else:
+            sigma = np.sqrt( np.nansum( np.where( valid, np.abs( Zc - Zavg )**2, np.nan ), axis=0 ) / ( n_used - 1 ) )
+        noise = sigma / np.sqrt( n_used ) / np.abs( Zavg )
+    return [ us.complex_to_polar( Zavg ), noise ]
+
+def complex_median( Zc ):
+    return np.nanmedian( Zc.real, axis=0 ) + 1j*np.nanmedian( Zc.imag, axis=0 )
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Running statistics of repeated impedance sweeps, in bounded memory.
+
+Accumulates mean, variance, min and max of |Z| and arg(Z) per frequency
+point, updated for each new sweep with Welford's algorithm, vectorised over
+all points. Memory use is proportional to the number of points, independent
+of the number of sweeps. Optional exponential averaging, weight 'alpha' on
+the newest sweep.
+
+Statistics are kept in the same layout as te_result.Z, columns [Zmag, Zphase]
+
+@author: larsh
+"""
+
+import numpy as np
+
+class sweep_statistics:
+    def __init__( self, alpha=None ):
+        self.alpha = alpha    # Weight of newest sweep in exponential average, None to skip
+        self.reset()
+
+    def reset( self, f=np.zeros(0) ):
+        npts = len( f )
+        self.f    = np.array( f, dtype=float )
+        self.n    = np.zeros( ( npts, 1 ) )         # Number of valid values per point
+        self.mean = np.zeros( ( npts, 2 ) )
+        self.m2   = np.zeros( ( npts, 2 ) )         # Sum of squared deviations from mean
+        self.min  = np.full ( ( npts, 2 ),  np.inf )
+        self.max  = np.full ( ( npts, 2 ), -np.inf )
+        self.ema  = np.full ( ( npts, 2 ),  np.nan )
+        self.n_sweeps = 0
+        return 0
+
+    def add( self, f, Z ):
+        """ Add sweep. f is frequency vector, Z=[Zmag, Zphase] as in te_result.
+            Restarts if the frequency points have changed. Points not read, NaN, are
+            not compared, e.g. the end of an interrupted sweep """
+        f = np.asarray( f, dtype=float )
+        read = np.isfinite( f ) & np.isfinite( self.f ) if len( f ) == len( self.f ) else None
+        if read is None or not np.array_equal( f[read], self.f[read] ):
+            self.reset( f )
+        self.f = np.where( np.isfinite( self.f ), self.f, f )   # Fill points missing from earlier sweeps
+        valid = np.all( np.isfinite( Z ), axis=1, keepdims=True )   # Points not read, e.g. interrupted sweep, are NaN
+        x     = np.where( valid, Z, 0.0 )
+        self.n     += valid
+        delta       = np.where( valid, x - self.mean, 0.0 )
+        self.mean  += delta / np.maximum( self.n, 1 )
+        self.m2    += delta * np.where( valid, x - self.mean, 0.0 )
+        self.min    = np.where( valid, np.minimum( self.min, x ), self.min )
+        self.max    = np.where( valid, np.maximum( self.max, x ), self.max )
+        if self.alpha is not None:
+            ema      = np.where( np.isnan( self.ema ), x, ( 1-self.alpha )*self.ema + self.alpha*x )
+            self.ema = np.where( valid, ema, self.ema )
+        self.n_sweeps += 1
+        return self.n_sweeps
+
+    def add_result( self, res ):   # Add sweep from te_result
+        return self.add( res.f, res.Z )
+
+    def var( self ):
+        with np.errstate( invalid='ignore', divide='ignore' ):
+            return np.where( self.n > 1, self.m2 / ( self.n - 1 ), np.nan )
+
+    def std( self ):
+        return np.sqrt( self.var() )
+
+    def noise( self ):
+        """ Typical noise over all points: Median relative std. of |Z| and std. of arg(Z) [rad] """
+        with np.errstate( invalid='ignore', divide='ignore' ):
+            s = self.std()
+            if np.all( np.isnan( s ) ):
+                return [ np.nan, np.nan ]
+            mag_rel = np.nanmedian( s[:,0] / self.mean[:,0] )
+            phase   = np.nanmedian( s[:,1] )
+        return [ mag_rel, phase ]
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Open-short-load calibration of impedance measurements.
+
+Removes the effect of cables and fixtures from measured impedance, using the
+standard three-term error model for one-port reflection measurements
+    Gm = e00 + e10e01*Ga/( 1 - e11*Ga )
+Gm is measured and Ga actual reflection coefficient. Error terms are found per
+frequency point from measurements of three known standards, open, short and
+load. The correction is precomputed as
+    Ga = ( Gm - e00 )/( e11*Gm - De ),   De = e00*e11 - e10e01
+which is applied to every new sweep at negligible cost.
+
+Calibrations are saved as .npz-files, named from the frequency range and
+number of points. If a sweep is measured at other frequencies than the
+calibration, the error terms are interpolated.
+
+Record calibration interactively
+    python te300x_calibration.py --port COM7 --fmin 0.3 --fmax 20 --npts 500
+
+@author: larsh
+"""
+
+import os
+import numpy as np
+import us_utilities as us           # Conversion between polar and complex impedance, and reflection coefficient
+import frequency_grid as fg          # Interpolation to other frequencies
+
+standards = [ 'open', 'short', 'load' ]
+
+#%% File names
+"""
+File name for calibration of frequency range, e.g. 'cal_0.30_20.00MHz_500pts.npz'
+"""
+def calibration_filename( f ):
+    return f'cal_{f[0]/1e6:.2f}_{f[-1]/1e6:.2f}MHz_{len(f):d}pts.npz'
+
+
+#%% Calibration
+class te300x_calibration:
+    def __init__( self, z0=50, z_load=50 ):
+        self.z0     = z0         # Reference impedance of instrument
+        self.z_load = z_load     # Impedance of load standard
+        self.measured = {}       # Measured standards, as [f, complex Z]
+        self.f      = np.zeros( 0 )
+        self.coefficients = np.zeros( ( 0, 3 ), dtype=complex )   # e00, e11, De per frequency
+        self.grid_cache = [ None, None ]    # Last frequency grid and interpolated coefficients
+
+    def actual_gamma( self, standard ):
+        if standard == 'open':
+            return 1.0
+        elif standard == 'short':
+            return -1.0
+        elif standard == 'load':
+            return us.z_to_gamma( self.z_load, self.z0 )
+        raise ValueError( f'Unknown calibration standard {standard}' )
+
+    def measure_standard( self, analyser, standard, n_sweeps=1 ):
+        """ Measure calibration standard with connected te300x analyser.
+            Several sweeps are averaged on computer if n_sweeps > 1.
+            Returns -1 if a sweep was lost, the standard is then not added """
+        calibration = analyser.calibration
+        analyser.calibration = None       # Standards are measured uncorrected
+        try:
+            if n_sweeps > 1:
+                errorcode = analyser.read_sweep_host_averaged( n_sweeps, method='sigmaclip' )
+            else:
+                errorcode = analyser.read_sweep_robust()
+        finally:
+            analyser.calibration = calibration
+        if errorcode == -1:
+            return -1
+        self.add_standard( standard, analyser.res.f, analyser.res.Z )
+        return 0
+
+    def add_standard( self, standard, f, Z ):   # Z as [Zmag, Zphase], as in te_result
+        self.actual_gamma( standard )     # Check name
+        self.measured[standard] = [ np.array( f, dtype=float ), us.polar_to_complex( np.asarray( Z ) ) ]
+        return 0
+
+    def compute( self ):
+        """ Find error terms from the three measured standards, solved for all frequencies at once """
+        missing = [ s for s in standards if s not in self.measured ]
+        if missing:
+            raise ValueError( f'Calibration standards not measured: {", ".join(missing)}' )
+        f = self.measured['open'][0]
+        for s in standards:
+            if not np.array_equal( self.measured[s][0], f ):
+                raise ValueError( 'Calibration standards measured at different frequencies' )
+
+        # Gm = e00 + Ga*Gm*e11 - Ga*De, one equation per standard and frequency
+        A = np.zeros( ( len(f), 3, 3 ), dtype=complex )
+        b = np.zeros( ( len(f), 3 ), dtype=complex )
+        for k, s in enumerate( standards ):
+            Gm = us.z_to_gamma( self.measured[s][1], self.z0 )
+            Ga = self.actual_gamma( s )
+            A[:,k,0] = 1
+            A[:,k,1] = Ga*Gm
+            A[:,k,2] = -Ga
+            b[:,k]   = Gm
+        self.f = f
+        self.coefficients = np.linalg.solve( A, b[...,np.newaxis] )[...,0]
+        self.grid_cache = [ None, None ]
+        return 0
+
+    def coefficients_at( self, f ):
+        """ Error terms at frequencies f, interpolated if different from calibration.
+            Result for last grid is cached """
+        if len( f ) == len( self.f ) and np.array_equal( f, self.f ):
+            return self.coefficients
+        if self.grid_cache[0] is not None and np.array_equal( f, self.grid_cache[0] ):
+            return self.grid_cache[1]
+        c = fg.interpolate( self.f, self.coefficients, f, axis=0 )   # Complex, NaN outside calibrated range
+        self.grid_cache = [ np.array( f ), c ]
+        return c
+
+    def apply( self, f, Z ):
+        """ Correct measured impedance. Z as [Zmag, Zphase], returns corrected Z in same format.
+            Frequencies outside the calibrated range are returned as NaN """
+        c  = self.coefficients_at( f )
+        Gm = us.z_to_gamma( us.polar_to_complex( np.asarray( Z ) ), self.z0 )
+        with np.errstate( invalid='ignore', divide='ignore' ):
+            Ga = ( Gm - c[:,0] )/( c[:,1]*Gm - c[:,2] )
+            return us.complex_to_polar( us.gamma_to_z( Ga, self.z0 ) )
+
+    def matches_z0( self, z0 ):   # Analyser calculates Z from its Zo, must be as when calibrated
+        return abs( z0 - self.z0 ) < 0.05
+
+    def save( self, caldir='calibration' ):   # Returns path of saved file
+        if not os.path.isdir( caldir ):
+            os.mkdir( caldir )
+        path = os.path.join( caldir, calibration_filename( self.f ) )
+        np.savez( path, f=self.f, coefficients=self.coefficients, z0=self.z0, z_load=self.z_load )
+        return path
+
+    def load( self, path ):
+        with np.load( path ) as cal:
+            self.f            = cal['f']
+            self.coefficients = cal['coefficients']
+            self.z0           = float( cal['z0'] )
+            self.z_load       = float( cal['z_load'] )
+        self.grid_cache = [ None, None ]
+        return 0
+
+"""
+Find calibration for frequencies f in directory caldir. Uses calibration on
+same frequencies if it exists, otherwise the one covering the range with most
+points. If z0 is given, only calibrations recorded at this Zo are used.
+Returns None if no calibration covers the range
+"""
+def find_calibration( f, caldir='calibration', z0=None ):
+    path = os.path.join( caldir, calibration_filename( f ) )
+    if os.path.isfile( path ):
+        cal = te300x_calibration()
+        cal.load( path )
+        if z0 is None or cal.matches_z0( z0 ):
+            return cal
+    path   = None
+    n_best = 0
+    if os.path.isdir( caldir ):
+        for name in os.listdir( caldir ):
+            if not name.endswith( '.npz' ):
+                continue
+            with np.load( os.path.join( caldir, name ) ) as cal:
+                fc    = cal['f']
+                cal_z0= float( cal['z0'] )
+            if z0 is not None and abs( z0 - cal_z0 ) >= 0.05:
+                continue
+            if fc[0] <= f[0] and fc[-1] >= f[-1] and len( fc ) > n_best:
+                path   = os.path.join( caldir, name )
+                n_best = len( fc )
+    if path is None:
+        return None
+    cal = te300x_calibration()
+    cal.load( path )
+    return cal
+
+
+#%% Record calibration
+if __name__ == "__main__":
+    import argparse
+    import trewmac300x_serial as te
+
+    parser = argparse.ArgumentParser( description='Record open-short-load calibration of Trewmac TE300x' )
+    parser.add_argument( '--port',   default='COM7' )
+    parser.add_argument( '--fmin',   type=float, default=0.3, help='Start frequency [MHz]' )
+    parser.add_argument( '--fmax',   type=float, default=20,  help='End frequency [MHz]' )
+    parser.add_argument( '--npts',   type=int,   default=500, help='Number of frequency points' )
+    parser.add_argument( '--average',type=int,   default=16,  help='Averaging in instrument' )
+    parser.add_argument( '--sweeps', type=int,   default=4,   help='Sweeps averaged on computer per standard' )
+    parser.add_argument( '--z0',     type=float, default=50,  help='Reference impedance Zo of analyser [Ohm], same as when measuring' )
+    parser.add_argument( '--zload',  type=float, default=50,  help='Impedance of load standard [Ohm]' )
+    parser.add_argument( '--caldir', default='calibration', help='Directory for calibration files' )
+    args = parser.parse_args()
+
+    analyser = te.te300x()
+    if analyser.connect( port=args.port ) == -1:
+        raise SystemExit( f'Error: Could not open {args.port}' )
+    analyser.set_frequencyrange( args.fmin*1e6, args.fmax*1e6, args.npts )
+    analyser.set_averaging( args.average )
+    z0  = analyser.set_z0( args.z0 )
+    cal = te300x_calibration( z0=z0, z_load=args.zload )
+    for standard in standards:
+        input( f'Connect {standard.upper()} standard and press Enter ' )
+        if cal.measure_standard( analyser, standard, n_sweeps=args.sweeps ) == -1:
+            analyser.close()
+            raise SystemExit( f'Error: Sweep of {standard} standard lost' )
+    analyser.close()
+    cal.compute()
+    print( f'Calibration saved to {cal.save( args.caldir )}' )
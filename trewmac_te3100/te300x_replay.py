@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Record and replay raw serial traffic to and from Trewmac TE300x analysers.
+
+serial_recorder wraps an open serial port and logs every write and read, with
+timestamps, to a binary file. serial_replay reads such a file and behaves like
+a serial port, feeding the recorded responses back to the unchanged driver in
+'trewmac300x_serial.py'. Replay runs either in real time, reproducing the
+instrument's timing, or as fast as possible for profiling parser and GUI code
+without an instrument attached.
+
+Log file format, IEEE big-endian as other result files from the lab
+    header length  [i4], header string
+    records until end of file:
+        direction  [u1]  b'W' written to instrument, b'R' read from instrument
+        time       [f8]  Seconds since recording started
+        length     [u4]  Number of bytes
+        data       [length bytes]
+
+@author: larsh
+"""
+
+import numpy as np
+import os
+import time
+
+log_header = "<TE300x_serial_log_be>"
+
+#%% Read log file
+"""
+Read all records from a serial log file.
+Returns list of [direction, time, data], direction is 'W' or 'R'
+"""
+def read_serial_log( logfile ):
+    records = []
+    with open( logfile, 'rb') as fid:
+        n_hd   = int( np.frombuffer( fid.read(4), dtype='>i4' )[0] )
+        header = fid.read( n_hd ).decode( 'utf-8' )
+        if header != log_header:
+            raise ValueError( f'{logfile} is not a TE300x serial log' )
+        while True:
+            direction = fid.read(1)
+            if len( direction ) < 1:
+                break
+            t    = float( np.frombuffer( fid.read(8), dtype='>f8' )[0] )
+            n    = int( np.frombuffer( fid.read(4), dtype='>u4' )[0] )
+            data = fid.read( n )
+            records.append( [ direction.decode(), t, data ] )
+    return records
+
+
+#%% Recording
+class serial_recorder:
+    """ Wrap an open serial port and log all traffic to file.
+        Attributes not handled here are passed on to the wrapped port """
+    def __init__( self, port, logfile ):
+        self.port = port
+        self.fid  = open( logfile, 'xb' )
+        self.fid.write( np.array( len(log_header) ).astype('>i4') )
+        self.fid.write( bytes( log_header, 'utf-8' ) )
+        self.t0   = time.perf_counter()
+
+    def __getattr__( self, name ):
+        return getattr( self.port, name )
+
+    def __setattr__( self, name, value ):   # Settings, e.g. timeout, are set on the wrapped port
+        if name in ( 'port', 'fid', 't0' ):
+            object.__setattr__( self, name, value )
+        else:
+            setattr( self.port, name, value )
+
+    def log( self, direction, data ):
+        t = time.perf_counter() - self.t0
+        self.fid.write( direction )
+        self.fid.write( np.array( t ).astype('>f8') )
+        self.fid.write( np.array( len(data) ).astype('>u4') )
+        self.fid.write( bytes(data) )
+        self.fid.flush()          # Keep log up to date if the program stops
+        return 0
+
+    def write( self, data ):
+        self.log( b'W', data )
+        return self.port.write( data )
+
+    def read( self, size=1 ):
+        data = self.port.read( size )
+        self.log( b'R', data )
+        return data
+
+    def read_until( self, expected=b'\n', size=None ):
+        data = self.port.read_until( expected=expected, size=size )
+        self.log( b'R', data )
+        return data
+
+    def stop( self ):   # Stop recording, return the original port
+        self.fid.close()
+        return self.port
+
+    def discard( self ):   # Stop recording and delete the log, e.g. if connecting failed
+        self.fid.close()
+        os.remove( self.fid.name )
+        return self.port
+
+    def close( self ):
+        self.fid.close()
+        return self.port.close()
+
+
+#%% Replay
+class serial_replay:
+    """ Serial port emulation replaying a recorded log.
+
+        Each write from the driver is matched to the next recorded write with
+        the same contents, and makes the bytes read after that command
+        available. The search wraps around to the start of the log, so a
+        recorded sweep can be replayed repeatedly. Writes not found in the
+        log advance to the next recorded command.
+        realtime=True  Bytes become available at their recorded delay after
+                       the command, waiting as the instrument did
+        realtime=False All bytes are available immediately """
+    def __init__( self, logfile, realtime=False, timeout=5 ):
+        records  = read_serial_log( logfile )
+        commands = []          # Each command as [time, written bytes, response bytes, arrival times]
+        pending  = [ 0.0, b'', [], [] ]
+        for direction, t, data in records:
+            if direction == 'W':
+                commands.append( pending )
+                pending = [ t, data, [], [] ]
+            elif len( data ) > 0:
+                pending[2].append( data )
+                pending[3].append( np.full( len(data), t - pending[0] ) )
+        commands.append( pending )
+
+        self.written  = [ command[1] for command in commands ]
+        self.commands = []
+        for t, written, data, arrival in commands:
+            if data:
+                self.commands.append( [ b''.join( data ), np.concatenate( arrival ) ] )
+            else:
+                self.commands.append( [ b'', np.zeros( 0 ) ] )
+        self.realtime = realtime
+        self.timeout  = timeout
+        self.baudrate = 115200
+        self.is_open  = True
+        self.n_command= 0
+        self.start_command( 0 )
+
+    def start_command( self, n ):
+        if n < len( self.commands ):
+            self.buffer, self.arrival = self.commands[n]
+        else:
+            self.buffer, self.arrival = b'', np.zeros( 0 )
+        self.pos    = 0
+        self.t_start= time.perf_counter()
+        return 0
+
+    def available( self ):   # Number of bytes received from the 'instrument'
+        if not self.realtime:
+            return len( self.buffer )
+        elapsed = time.perf_counter() - self.t_start
+        return int( np.searchsorted( self.arrival, elapsed, side='right' ) )
+
+    @property
+    def in_waiting( self ):
+        return self.available() - self.pos
+
+    def find_command( self, data ):   # Next recorded command with same contents, wrapping around
+        n_total = len( self.written )
+        for k in range( 1, n_total+1 ):
+            n = ( self.n_command + k ) % n_total
+            if self.written[n] == bytes( data ):
+                return n
+        return self.n_command + 1
+
+    def write( self, data ):
+        self.n_command = self.find_command( data )
+        self.start_command( self.n_command )
+        return len( data )
+
+    def wait_for( self, n ):   # Wait until byte n has arrived, or timeout
+        if self.realtime and n <= len( self.arrival ):
+            delay = self.arrival[n-1] - ( time.perf_counter() - self.t_start )
+            if self.timeout is not None:
+                delay = min( delay, self.timeout )
+            if delay > 0:
+                time.sleep( delay )
+        return min( n, self.available() )
+
+    def read( self, size=1 ):
+        end  = self.wait_for( self.pos + size )
+        data = self.buffer[ self.pos:end ]
+        self.pos = max( self.pos, end )
+        return data
+
+    def read_until( self, expected=b'\n', size=None ):
+        n = self.buffer.find( expected, self.pos )
+        if n < 0:
+            end = len( self.buffer )
+        else:
+            end = n + len( expected )
+        if size is not None:
+            end = min( end, self.pos + size )
+        return self.read( end - self.pos )
+
+    def reset_input_buffer( self ):
+        self.pos = self.available()
+        return 0
+
+    def set_buffer_size( self, rx_size=4096, tx_size=None ):
+        return 0
+
+    def close( self ):
+        self.is_open = False
+        return 0
+
+
+#%% Replay recorded session and profile the driver
+if __name__ == "__main__":
+    import argparse
+    import cProfile
+    import pstats
+    import trewmac300x_serial as te
+
+    parser = argparse.ArgumentParser( description='Replay recorded TE300x serial log and read sweeps' )
+    parser.add_argument( 'logfile' )
+    parser.add_argument( '--sweeps',   type=int, default=1, help='Number of sweeps to read' )
+    parser.add_argument( '--realtime', action='store_true', help='Reproduce recorded timing' )
+    parser.add_argument( '--profile',  action='store_true', help='Profile sweep parsing' )
+    args = parser.parse_args()
+
+    analyser = te.te300x()
+    analyser.replay( args.logfile, realtime=args.realtime )
+    profiler = cProfile.Profile()
+    t0 = time.perf_counter()
+    if args.profile:
+        profiler.enable()
+    for k in range( args.sweeps ):
+        analyser.read_sweep_point_by_point()
+    if args.profile:
+        profiler.disable()
+    elapsed = time.perf_counter() - t0
+    print( f'{args.sweeps} sweeps, {analyser.res.nf} points, {elapsed:.3f} s' )
+    if args.profile:
+        pstats.Stats( profiler ).sort_stats( 'cumulative' ).print_stats( 20 )
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Export impedance results to Touchstone (.s1p) or CSV files, for use in
+other programs.
+
+Reads
+    Impedance results from 'save_impedance_result', Trewmac TE300x
+    Traces saved from LabVIEW, R&S ZVL, channels S11 real and imaginary part
+Writes
+    s1p  Touchstone, S11 as real and imaginary part, reference impedance z0
+    csv  Frequency, Z as real, imaginary, magnitude and phase, and S11
+
+Conversion between impedance and S11 is vectorised over all points.
+Files are converted in parallel processes, the output directory tree
+mirrors the input tree.
+
+Example
+    python trace_export.py results --format s1p --outdir export
+
+@author: larsh
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import us_utilities as us            # Load results, conversion of impedance
+
+export_formats = [ 's1p', 'csv' ]
+
+#%% Read files
+"""
+Read impedance result or ZVL trace. Returns header, time (empty if not
+stored), frequency vector, and complex impedance and S11
+"""
+def load_impedance( path, z0=50 ):
+    hd = us.read_trace_header( path )
+    if hd.format == 'impedance':          # TE300x, magnitude and phase
+        res = us.load_impedance_result( path )
+        Zc  = us.polar_to_complex( res.Z )
+        return [ res.header, res.time, res.f, Zc, us.z_to_gamma( Zc, z0 ) ]
+    if hd.format == 'waveform':
+        raise ValueError( f'{path} is a waveform, not an impedance result' )
+    trace = us.load_trace( path )         # ZVL, S11 as real and imaginary part
+    S11 = trace.y[:,0] + 1j*trace.y[:,1]
+    return [ trace.header, '', trace.x, us.gamma_to_z( S11, z0 ), S11 ]
+
+
+#%% Write files
+def write_touchstone( outfile, f, S11, z0=50, comments=[] ):
+    with open( outfile, 'wt' ) as fid:
+        for comment in comments:
+            fid.write( f'! {comment}\n' )
+        fid.write( f'# Hz S RI R {z0:g}\n' )
+        np.savetxt( fid, np.column_stack( ( f, S11.real, S11.imag ) ), fmt='%.6e' )
+    return 0
+
+def write_csv( outfile, f, Zc, S11, comments=[] ):
+    with open( outfile, 'wt' ) as fid:
+        for comment in comments:
+            fid.write( f'# {comment}\n' )
+        fid.write( 'f [Hz],Re(Z) [Ohm],Im(Z) [Ohm],|Z| [Ohm],arg(Z) [Deg],Re(S11),Im(S11)\n' )
+        values = np.column_stack( ( f, Zc.real, Zc.imag, np.abs( Zc ), np.degrees( np.angle( Zc ) ), S11.real, S11.imag ) )
+        np.savetxt( fid, values, fmt='%.6e', delimiter=',' )
+    return 0
+
+"""
+Export one file. Returns [path, output file or error message, ok]
+"""
+def export_file( path, outfile, export_format='s1p', z0=50 ):
+    try:
+        [ header, meastime, f, Zc, S11 ] = load_impedance( path, z0 )
+        comments = [ f'Source {os.path.basename( path )}', f'Header {header}' ]
+        if meastime:
+            comments.append( f'Measured {meastime}' )
+        os.makedirs( os.path.dirname( outfile ) or '.', exist_ok=True )
+        if export_format == 's1p':
+            write_touchstone( outfile, f, S11, z0, comments )
+        else:
+            write_csv( outfile, f, Zc, S11, comments )
+        return [ path, outfile, True ]
+    except ( OSError, ValueError, IndexError ) as error:
+        return [ path, str( error ), False ]
+
+
+#%% Export directory tree
+"""
+Export all .trc-files under rootdir to outdir, in parallel processes.
+Returns list of [path, output file or error message, ok]
+"""
+def export_tree( rootdir, outdir='export', export_format='s1p', z0=50, workers=None ):
+    if export_format not in export_formats:
+        raise ValueError( f'Unknown export format {export_format}' )
+    paths    = []
+    outfiles = []
+    for dirpath, dirnames, filenames in os.walk( rootdir ):
+        for name in sorted( filenames ):
+            if name.lower().endswith( '.trc' ):
+                path = os.path.join( dirpath, name )
+                paths.append( path )
+                outfiles.append( os.path.join( outdir, os.path.splitext( os.path.relpath( path, rootdir ) )[0] + '.' + export_format ) )
+    n = len( paths )
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor( max_workers=workers ) as pool:    # Several files per task, reduces overhead
+        results = list( pool.map( export_file, paths, outfiles, [export_format]*n, [z0]*n,
+                                  chunksize=max( 1, n//( 4*workers ) ) ) )
+    return results
+
+
+#%% Main function
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser( description='Export impedance results to Touchstone or CSV files' )
+    parser.add_argument( 'rootdir', help='Top directory of result files' )
+    parser.add_argument( '--format', dest='export_format', default='s1p', choices=export_formats )
+    parser.add_argument( '--outdir', default='export', help='Directory for exported files' )
+    parser.add_argument( '--z0',     type=float, default=50, help='Reference impedance for S11 [Ohm]' )
+    parser.add_argument( '--workers',type=int, default=None, help='Parallel processes, default number of CPUs' )
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    results = export_tree( args.rootdir, args.outdir, args.export_format, args.z0, args.workers )
+    for path, message, ok in results:
+        if not ok:
+            print( f'Not exported: {path}, {message}' )
+    n_ok = sum( ok for path, message, ok in results )
+    print( f'{n_ok} of {len(results)} files exported to {args.outdir}, {time.perf_counter()-t0:.2f} s' )
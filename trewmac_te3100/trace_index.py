@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Index of result files in a directory tree, searchable by contents of the
+file headers.
+
+Reads only the header of each file, not the data. Handles
+    Impedance results from 'save_impedance_result', header '<Z_mag_phase...'
+    Waveforms from 'waveform.save', header '<WFM_Python...'
+    Traces saved from LabVIEW, e.g. R&S ZVL, read by 'readtrace.m'
+
+The index is stored as an SQLite database file in the top directory.
+Files are identified by path, modification time and size. Repeated scans
+only read files that are new or changed since the last scan, and remove
+files that no longer exist. Headers are read in parallel.
+
+Example
+    python trace_index.py scan results
+    python trace_index.py query results --from 2023-01-01 --to 2023-01-31 --header Z_mag
+
+@author: larsh
+"""
+
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import us_utilities as us            # Reading result file headers
+
+index_filename = 'trace_index.sqlite'
+trace_extensions = ( 'trc', 'wfm' )
+columns = [ 'path', 'mtime', 'size', 'format', 'header', 'time', 'nc', 'npts', 'x0', 'dx' ]
+
+#%% Read file headers
+"""
+Read header of one result file, see 'us_utilities.read_trace_header'. Returns
+dict with the fields in 'columns', values not stored in the file format are None
+"""
+def index_entry( path ):
+    info = dict.fromkeys( columns )
+    stat = os.stat( path )
+    info['path']  = path
+    info['mtime'] = stat.st_mtime
+    info['size']  = stat.st_size
+    hd = us.read_trace_header( path )
+    for c in [ 'format', 'header', 'time', 'nc', 'x0', 'dx' ]:
+        info[c] = getattr( hd, c )
+    if hd.nc > 0:
+        info['npts'] = ( info['size'] - hd.eoh ) // ( 4*hd.nc )
+    return info
+
+def try_read_header( path ):   # Unreadable or truncated files are indexed without header
+    try:
+        return index_entry( path )
+    except ( OSError, ValueError, IndexError, UnicodeDecodeError ):
+        info = dict.fromkeys( columns )
+        info['path'] = path
+        return info
+
+
+#%% Index
+class trace_index:
+    def __init__( self, rootdir, indexfile=None ):
+        self.rootdir = os.path.abspath( rootdir )
+        if indexfile is None:
+            indexfile = os.path.join( self.rootdir, index_filename )
+        self.db = sqlite3.connect( indexfile )
+        self.db.execute( 'CREATE TABLE IF NOT EXISTS traces ( path TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+                         'format TEXT, header TEXT, time TEXT, nc INTEGER, npts INTEGER, x0 REAL, dx REAL )' )
+        self.db.execute( 'CREATE INDEX IF NOT EXISTS traces_time ON traces ( time )' )
+        self.db.commit()
+
+    def find_files( self, extensions=trace_extensions ):   # All result files, as {relative path: (mtime, size)}
+        files = {}
+        for dirpath, dirnames, filenames in os.walk( self.rootdir ):
+            for name in filenames:
+                if name.split('.')[-1].lower() in extensions:
+                    path = os.path.join( dirpath, name )
+                    stat = os.stat( path )
+                    files[ os.path.relpath( path, self.rootdir ) ] = ( stat.st_mtime, stat.st_size )
+        return files
+
+    def scan( self, extensions=trace_extensions, workers=8 ):
+        """ Update index with new and changed files. Returns [n_new, n_removed, n_total] """
+        files   = self.find_files( extensions )
+        indexed = { row[0]: ( row[1], row[2] ) for row in self.db.execute( 'SELECT path, mtime, size FROM traces' ) }
+        changed = [ path for path, stamp in files.items() if indexed.get( path ) != stamp ]
+        removed = [ path for path in indexed if path not in files ]
+
+        fullpaths = [ os.path.join( self.rootdir, path ) for path in changed ]
+        with ThreadPoolExecutor( max_workers=workers ) as pool:
+            headers = list( pool.map( try_read_header, fullpaths ) )
+        rows = []
+        for path, info in zip( changed, headers ):
+            info['path'] = path
+            info['mtime'], info['size'] = files[path]
+            rows.append( [ info[c] for c in columns ] )
+
+        self.db.executemany( f'INSERT OR REPLACE INTO traces VALUES ( {",".join( "?"*len(columns) )} )', rows )
+        self.db.executemany( 'DELETE FROM traces WHERE path = ?', [ [path] for path in removed ] )
+        self.db.commit()
+        return [ len( changed ), len( removed ), len( files ) ]
+
+    def query( self, time_from=None, time_to=None, header=None, file_format=None, min_npts=None, max_npts=None ):
+        """ Find files. Times as in file, 'YYYY-MM-DD-hh-mm-ss', or the start of this, e.g. 'YYYY-MM-DD'.
+            'header' matches part of header text. Returns list of dicts """
+        conditions = []
+        values     = []
+        if time_from is not None:
+            conditions.append( 'time >= ?' )
+            values.append( time_from )
+        if time_to is not None:    # Include all of last period, e.g. whole day
+            conditions.append( 'substr( time, 1, ? ) <= ?' )
+            values += [ len( time_to ), time_to ]
+        if header is not None:
+            conditions.append( 'header LIKE ?' )
+            values.append( f'%{header}%' )
+        if file_format is not None:
+            conditions.append( 'format = ?' )
+            values.append( file_format )
+        if min_npts is not None:
+            conditions.append( 'npts >= ?' )
+            values.append( min_npts )
+        if max_npts is not None:
+            conditions.append( 'npts <= ?' )
+            values.append( max_npts )
+        sql = 'SELECT * FROM traces'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join( conditions )
+        sql += ' ORDER BY time, path'
+        return [ dict( zip( columns, row ) ) for row in self.db.execute( sql, values ) ]
+
+    def close( self ):
+        self.db.close()
+        return 0
+
+
+#%% Main function
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser( description='Index and search result files by header contents' )
+    parser.add_argument( 'command', choices=['scan', 'query'] )
+    parser.add_argument( 'rootdir', help='Top directory of result files' )
+    parser.add_argument( '--from',   dest='time_from', default=None, help='Measured at or after, e.g. 2023-01-01' )
+    parser.add_argument( '--to',     dest='time_to',   default=None, help='Measured at or before, e.g. 2023-01-31' )
+    parser.add_argument( '--header', default=None, help='Part of header text' )
+    parser.add_argument( '--format', dest='file_format', default=None, choices=['impedance', 'waveform', 'trace'] )
+    parser.add_argument( '--min-npts', type=int, default=None )
+    parser.add_argument( '--max-npts', type=int, default=None )
+    parser.add_argument( '--workers',  type=int, default=8, help='Files read in parallel' )
+    args = parser.parse_args()
+
+    index = trace_index( args.rootdir )
+    if args.command == 'scan':
+        t0 = time.perf_counter()
+        [ n_new, n_removed, n_total ] = index.scan( workers=args.workers )
+        print( f'{n_total} files, {n_new} new or changed, {n_removed} removed, {time.perf_counter()-t0:.2f} s' )
+    else:
+        for row in index.query( args.time_from, args.time_to, args.header, args.file_format, args.min_npts, args.max_npts ):
+            print( f"{row['path']}  {row['time'] or '':19s}  {row['header']}  {row['nc']} ch  {row['npts']} pts" )
+    index.close()
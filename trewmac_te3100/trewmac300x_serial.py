@@ -16,10 +16,14 @@ Created on Mon Dec 12 11:36:32 2022
 import serial    # Uses serial communication (COM-ports)
 import numpy as np
 import time
+import te300x_replay as te_replay    # Record and replay of serial traffic
+import sweep_averaging as avg        # Averaging sweeps on computer
 # import os
 # import datetime
 
 terminator=b'\r'
+supported_baudrates = [ 115200, 9600 ]   # Ref. Trewmac Hardvare guide, TM1227
+version_prefix = 'TE3'                   # Reply to 'V', e.g. 'TE3000 F/W V1.0'
 
 #%% Result structure
 class te_result:  # Initialise with impossible values. To be set at object creation
@@ -29,6 +33,7 @@ class te_result:  # Initialise with impossible values. To be set at object creat
         self.npts    = 0
         
         self.averaging =-1.0
+        self.host_averaging = 1    # Sweeps averaged on computer, see read_sweep_host_averaged
         self.z0        =-1.0
         self.output    =-1.0
         
@@ -43,31 +48,176 @@ class te_result:  # Initialise with impossible values. To be set at object creat
 class te300x:
     def __init__( self ):
         self.res  = te_result()
+        self.port = -1            # Serial port, -1 when not open
+        self.settings    = {}     # Last accepted settings as sent, arguments to 'set_<name>', see restore_settings
+        self.calibration = None   # Open-short-load calibration applied to all sweeps, see 'te300x_calibration.py'
+        self.connected   = False
+        self.probe_timeout = 0.5  # s  Short timeout when checking if analyser responds
+        self.n_lost      = 0      # Sweeps lost, not completed after reconnecting
+        self.bytes_read  = 0      # Bytes received from analyser, for throughput measurements
         return       
         
-    def connect( self, port = 'COM1', timeout = 5 ):
+    def connect( self, port = 'COM1', timeout = 5, logfile = None ):
+        self.port_name = port
+        self.timeout   = timeout
+        if port.lower().startswith( 'replay:' ):   # Port 'replay:<logfile>' replays a recorded session
+            return self.replay( port.split(':', 1)[1] )
         try:
-            self.port = serial.Serial( port, 115200, timeout = timeout )    
-            self.port.set_buffer_size(rx_size = 100000, tx_size = 100000)
-            self.set_frequencyrange( fmin= 300e3, fmax= 20e6, npts= 500 )
-            self.set_averaging ( avg = 16 )
-            self.set_z0 ( z0 = 50 )
-            self.set_output ( output = 100 )
-            self.set_format( dataformat = 'polZ' )
-            self.set_mode ( mode = 'T' )
+            self.port = self.open_port()
+            if not self.find_baudrate():
+                raise TimeoutError( f'No response from analyser on {port}' )
+            if logfile:   # Record all serial traffic, for replay without instrument
+                self.port = te_replay.serial_recorder( self.port, logfile )
+            self.initialise()
+            self.negotiate_baudrate()
             errorcode = 0
         except: #serial.SerialException:
+            if isinstance( self.port, te_replay.serial_recorder ):
+                self.port = self.port.discard()   # Log can be reused when trying again
+            self.close_port()
             self.port = -1            
+            self.connected = False
             errorcode = -1
         return errorcode    
+
+    def open_port( self ):   # Open at last used baud rate
+        baudrate = int( self.res.baudrate ) if self.res.baudrate > 0 else supported_baudrates[0]
+        port = serial.Serial( self.port_name, baudrate, timeout = self.timeout )    
+        port.set_buffer_size(rx_size = 100000, tx_size = 100000)
+        return port
+
+    def close_port( self ):   # Close serial port, ignore errors if already lost
+        port = self.port
+        if isinstance( port, te_replay.serial_recorder ):
+            port = port.port      # Keep recording to same log after reconnecting
+        try:
+            port.close()
+        except: 
+            pass
+        return 0
+
+    def probe( self ):
+        """ Check that analyser responds, with short timeout. Returns True if connected """
+        timeout = self.port.timeout
+        try:
+            self.port.timeout = self.probe_timeout
+            self.port.reset_input_buffer()
+            self.connected = self.read_version().startswith( version_prefix )   # Not a line left from a sweep
+        except ( serial.SerialException, OSError, UnicodeDecodeError ):
+            self.connected = False
+        finally:
+            try:
+                self.port.timeout = timeout
+            except ( serial.SerialException, OSError ):
+                self.connected = False
+        return self.connected
+
+    def discard_input( self ):
+        """ Read and discard the rest of an interrupted sweep, until 'END' or no more data arrives """
+        timeout = self.port.timeout
+        try:
+            self.port.timeout = self.probe_timeout
+            while True:
+                rep = self.port.read_until( expected= terminator, size= 1000 )
+                if rep == b'' or rep.removesuffix( terminator ) == b'END':
+                    break
+        except ( serial.SerialException, OSError ):
+            self.connected = False
+        finally:
+            try:
+                self.port.timeout = timeout
+            except ( serial.SerialException, OSError ):
+                self.connected = False
+        return 0
+
+    def reconnect( self, attempts = 3, delay = 1.0 ):
+        """ Reopen port after connection is lost, and restore settings from res. 
+            Returns 0 if connected, -1 if not """
+        if self.port_name.lower().startswith( 'replay:' ):
+            return self.replay( self.port_name.split(':', 1)[1] )
+        for k in range( attempts ):
+            self.close_port()
+            try:
+                port = self.open_port()
+                if isinstance( self.port, te_replay.serial_recorder ):
+                    self.port.port = port
+                else:
+                    self.port = port
+                if self.find_baudrate():
+                    self.restore_settings()
+                    self.negotiate_baudrate()   # Analyser restarts at 9600 after power-cycle
+                    return 0
+            except ( serial.SerialException, OSError, ValueError, IndexError ):
+                self.connected = False
+            time.sleep( delay )
+        return -1
+
+    def find_baudrate( self ):
+        """ Find baud rate the analyser uses, starting with current port setting.
+            Returns True if analyser responds """
+        rates = [ self.port.baudrate ] + [ r for r in supported_baudrates if r != self.port.baudrate ]
+        for rate in rates:
+            self.port.baudrate = rate
+            if self.probe():
+                self.res.baudrate = rate
+                return True
+        return False
+
+    def negotiate_baudrate( self, rates = supported_baudrates ):
+        """ Switch analyser and port to highest baud rate that works. Returns baud rate in use """
+        current = self.res.baudrate
+        for rate in sorted( rates, reverse=True ):
+            if rate <= current:
+                break
+            try:
+                self.set_baudrate( rate )
+                if self.probe():
+                    return self.res.baudrate
+            except ( serial.SerialException, OSError, ValueError, IndexError ):
+                pass
+            self.port.baudrate = current    # Failed, find rate analyser uses now
+            self.find_baudrate()
+        return self.res.baudrate
+
+    def restore_settings( self ):   # Resend last accepted settings to analyser, e.g. after reconnecting
+        if not self.settings:
+            return self.initialise()
+        settings = dict( self.settings )
+        for name in [ 'frequencyrange', 'averaging', 'z0', 'output', 'format', 'mode' ]:
+            if name in settings:
+                getattr( self, f'set_{name}' )( *settings[name] )
+        return 0
+
+    def replay( self, logfile, realtime = False ):   # Use recorded session from 'connect( logfile= ... )' instead of instrument
+        try:
+            self.port = te_replay.serial_replay( logfile, realtime = realtime )
+            self.initialise()
+            self.connected = True
+            errorcode = 0
+        except:
+            self.port = -1
+            self.connected = False
+            errorcode = -1
+        return errorcode
+
+    def initialise( self ):
+        self.set_frequencyrange( fmin= 300e3, fmax= 20e6, npts= 500 )
+        self.set_averaging ( avg = 16 )
+        self.set_z0 ( z0 = 50 )
+        self.set_output ( output = 100 )
+        self.set_format( dataformat = 'polZ' )
+        self.set_mode ( mode = 'T' )
+        return 0
             
     def close(self):
         self.port.close()
+        self.connected = False
         return 0      
 
     #%% Utilities
     def read_text( self, max_length = 1000 ):
         rep = self.port.read_until( expected= terminator, size= max_length )
+        self.bytes_read += len( rep )
         return rep.removesuffix( terminator ).decode()
         
     def read_values( self, max_length = 1000 ):
@@ -80,13 +230,17 @@ class te300x:
         finished = False
         val=b''
         while not(finished):  # Read multiple times until all data acquired
-            val = val + self.port.read_until( expected = b'END\r' )   
+            rep = self.port.read_until( expected = b'END\r' )   
+            self.bytes_read += len( rep )
+            val = val + rep
             finished = (self.port.in_waiting == 0)
         return val.decode()
     
     def read_sweep_line(self):
         f   = Zmag = Zphi = 0
         val = self.read_text()           
+        if val == '':
+            raise TimeoutError( 'No response from analyser' )
         finished = (val=='END') 
         if not(finished):
             line= val.split(',')
@@ -124,29 +278,33 @@ class te300x:
     def set_frequencyrange( self, fmin= 300e3, fmax= 20e6, npts= 801 ):
         self.res.fmin = self.send_freqrange ( 'S', f'{fmin/1e6:.2f}'  )  
         self.res.fmax = self.send_freqrange ( 'E', f'{fmax/1e6:.2f}'  )
-        npts          = self.send_freqrange ( 'P', f'{npts:d}'  ) 
-        self.res.npts = int (npts )                             
+        self.res.npts = int( self.send_freqrange ( 'P', f'{npts:d}'  ) )
+        self.settings['frequencyrange'] = [ fmin, fmax, npts ]   # Frequencies in Hz, as requested
         return 0
     
     def set_format( self, dataformat = 'polZ' ):   # Measurement format fixed to polar impedance
         result = self.send_configure ( 'format', dataformat )      
         self.res.format = result.split('=')[1] 
+        self.settings['format'] = [ dataformat ]   # Command token, e.g. 'polZ', not the reply
         return self.res.format 
     
     def set_averaging ( self, avg = 64 ):         
         result = self.send_configure ( 'averaging', f'{avg:d}' )       
         self.res.averaging = int( result.split('=')[1] )
+        self.settings['averaging'] = [ avg ]
         return self.res.averaging
 
     def set_output ( self, output = 100 ):  
         result = self.send_configure ( 'output', f'{output:.0f}' )      
         value  = result.split('=')[1]
         self.res.output  = float( value.split('%')[0] )
+        self.settings['output'] = [ output ]
         return self.res.output  
     
     def set_z0 ( self, z0 = 50 ):  
         result = self.send_configure ( 'zo', f'{z0:0.1f}' )    
         self.res.z0  = float( result.split('=')[1] )
+        self.settings['z0'] = [ z0 ]
         return self.res.z0
     
     def set_mode ( self, mode = 'T' ):  
@@ -156,6 +314,7 @@ class te300x:
             value= 'S21'
         result = self.send_configure ( 'mode', value )      
         self.res.mode  = result.split('=')[1]
+        self.settings['mode'] = [ mode ]
         return self.res.mode 
 
     def set_baudrate( self, baud = 115200 ):  
@@ -163,8 +322,9 @@ class te300x:
             baud = 115200
         else:
             baud = 9600        
-        result = self.send_configure( 'baud', f'{baud:d}' )      
-        self.res.baudrate  = result.split(' ')[2]
+        result = self.send_configure( 'baud', f'{baud:d}' )    # Reply 'Baud=9.6k' or 'Baud=115.2k'
+        self.res.baudrate  = int( float( result.split('=')[1].lower().removesuffix('k') )*1000 )
+        self.port.baudrate = self.res.baudrate     # Analyser has changed, reopen port at new rate
         return self.res.baudrate            
     
     #%% Read results
@@ -176,9 +336,11 @@ class te300x:
         self.res.Z    = np.stack( ( np.array(rep[0]) , np.array(rep[1]) ) ) 
         return rep
    
-    def read_sweep_point_by_point( self, resultgraph = [], resultfig = [] ):  
+    def read_sweep_point_by_point( self, resultplot = None ):   # resultplot: Live display, see 'impedance_plot.py'
+        """ Read one sweep. Returns 0 if complete, i.e. 'END' after npts points, -1 if not, 
+            e.g. timeout, lost connection or corrupted line. Points not read are NaN """
         n_old = len(self.res.f)
-        if n_old == self.res.npts:
+        if n_old == self.res.npts:     # Previous sweep shown until overwritten
             f      = self.res.f.copy()
             Zmag   = self.res.Z[:,0].copy()
             Zphase = self.res.Z[:,1].copy()    
@@ -187,26 +349,105 @@ class te300x:
             Zmag  = np.full( self.res.npts, np.nan )
             Zphase= np.full( self.res.npts, np.nan )
         
-        self.port.write(b'N')  # Command to read frequency scan. Ref. Trewmac Hardvare guide, TM1227
-        header   = self.read_text()
-        finished = False
+        complete = False
         nf       = 0
-        while not(finished):               
-            ret= self.read_sweep_line()
-            finished = ret[3] or (nf >= self.res.npts )
-            if not(finished):
-                f[nf]     = ret[0] 
-                Zmag[nf]  = ret[1] 
-                Zphase[nf]= np.radians(ret[2])   # Phase is saved as radians but plotted as degrees
-                if resultgraph and resultfig:
-                    resultgraph[0].set_data( f/1e6, Zmag ) 
-                    resultgraph[1].set_data( f/1e6, np.degrees( Zphase ) ) 
-                    resultfig.canvas.draw()            # --- TRY: Probably necessary
-                    resultfig.canvas.flush_events()    # --- TRY: Probably unnecessary if called in program                
-                nf+=1
+        try:
+            self.port.reset_input_buffer()    # Discard remains of interrupted sweep
+            self.port.write(b'N')  # Command to read frequency scan. Ref. Trewmac Hardvare guide, TM1227
+            header   = self.read_text()
+            if header == '':
+                raise TimeoutError( 'No response from analyser' )
+            finished = False
+            while not(finished):               
+                ret= self.read_sweep_line()
+                finished = ret[3]
+                if finished:
+                    complete = ( nf == self.res.npts )   # 'END' after all points
+                elif nf >= self.res.npts:
+                    raise ValueError( 'More points than requested' )
+                else:
+                    f[nf]     = ret[0] 
+                    Zmag[nf]  = ret[1] 
+                    Zphase[nf]= np.radians(ret[2])   # Phase is saved as radians but plotted as degrees
+                    if resultplot is not None:     # Rate limited by the plot, skipped if too soon
+                        resultplot.update( f, Zmag, np.degrees( Zphase ) )
+                    nf+=1
+        except ( TimeoutError, serial.SerialException, OSError ):   # Connection lost
+            self.connected = False
+        except ( ValueError, IndexError, UnicodeDecodeError ):     # Corrupted line, sweep incomplete
+            self.discard_input()               # Resynchronise before next command
+        if not complete:
+            f[nf:] = Zmag[nf:] = Zphase[nf:] = np.nan
         Z = np.stack(( np.array(Zmag), np.array(Zphase) ))
         Z = np.require( Z.T, requirements='C' )   # Transpose and ensure 'c-contiguous' array
+        if self.calibration is not None:          # Correct for cables and fixture, see 'te300x_calibration.py'
+            Z = np.require( self.calibration.apply( f, Z ), requirements='C' )
+        if resultplot is not None:
+            resultplot.update( f, Z[:,0], np.degrees( Z[:,1] ), force=True )
         self.res.f  = f.copy()
         self.res.Z  = Z.copy()
         self.res.nf = nf
-        return 0    
+        return 0 if complete else -1
+
+    def read_sweep_robust( self, resultplot = None, max_retries = 1 ):
+        """ Read one sweep, reconnect and repeat if interrupted. 
+            Returns 0 if complete, -1 if the sweep was lost """
+        for attempt in range( max_retries + 1 ):
+            if not self.connected and self.reconnect() != 0:
+                continue
+            if self.read_sweep_point_by_point( resultplot ) == 0:
+                return 0
+            if self.connected and not self.probe():   # Incomplete sweep, check connection
+                self.connected = False
+        self.n_lost += 1
+        return -1
+
+    def measure_throughput( self, formats = None, n_sweeps = 1 ):
+        """ Measure data transfer of sweeps for data formats accepted by 'set_format',
+            see Trewmac Hardvare guide, TM1227. Reads raw sweeps, independent of format.
+            Returns list of [format, bytes per point, points/s, bytes/s] """
+        original = self.settings.get( 'format', [ 'polZ' ] )[0]   # Command token, res.format is the reply
+        if formats is None:
+            formats = [ original ]
+        results = []
+        try:
+            for dataformat in formats:
+                try:
+                    self.set_format( dataformat = dataformat )
+                except ( ValueError, IndexError ):   # Format not accepted by analyser
+                    continue
+                n_bytes  = 0
+                n_points = 0
+                t0 = time.perf_counter()
+                for k in range( n_sweeps ):
+                    self.port.reset_input_buffer()
+                    b0 = self.bytes_read
+                    self.port.write(b'N')
+                    lines = self.read_sweep_values().split( terminator.decode() )
+                    n_bytes  += self.bytes_read - b0
+                    n_points += len( [ line for line in lines[1:] if line not in ( '', 'END' ) ] )   # First line is header
+                elapsed = time.perf_counter() - t0
+                if n_points > 0:
+                    results.append( [ dataformat, n_bytes/n_points, n_points/elapsed, n_bytes/elapsed ] )
+        finally:    # Also if a sweep failed, values in other formats are read as |Z| and phase without error
+            self.discard_input()           # Remains of failed sweep
+            self.set_format( dataformat = original )
+        return results
+
+    def read_sweep_host_averaged( self, n_sweeps = 4, method = 'sigmaclip', resultplot = None ):   
+        """ Read several sweeps and average them on the computer, see 'sweep_averaging.py'.
+            Reconnects if connection is lost, see read_sweep_robust. Returns 0 if all 
+            sweeps were read, -1 if one was lost. Relative noise per point in res.noise """
+        Z = np.full( ( n_sweeps, self.res.npts, 2 ), np.nan )
+        for k in range( n_sweeps ):
+            if self.read_sweep_robust( resultplot ) == -1:
+                return -1
+            if k == 0:
+                f = self.res.f.copy()          # Complete sweep, no NaN-tail
+            Z[k] = self.res.Z
+        [ Zavg, noise ] = avg.combine_sweeps( Z, method = method )
+        self.res.f     = f
+        self.res.Z     = np.require( Zavg, requirements='C' )
+        self.res.noise = noise
+        self.res.host_averaging = n_sweeps
+        return 0
@@ -6,7 +6,6 @@ Created on Tue Sep 13 21:46:41 2022
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 import os
 import datetime
 
@@ -26,6 +25,25 @@ def scale125(x):
         
     return xn
 
+"""
+Conversion between polar and complex impedance. Z as [Zmag, Zphase] in last
+dimension, phase in radians, as in te_result.Z
+"""
+def polar_to_complex( Z ):
+    return Z[...,0] * np.exp( 1j*Z[...,1] )
+
+def complex_to_polar( Zc ):
+    return np.stack( ( np.abs( Zc ), np.angle( Zc ) ), axis=-1 )
+
+"""
+Conversion between impedance and reflection coefficient, reference impedance z0
+"""
+def z_to_gamma( Zc, z0=50 ):
+    return ( Zc - z0 )/( Zc + z0 )
+
+def gamma_to_z( G, z0=50 ):
+    return z0*( 1 + G )/( 1 - G )
+
 """
 Define file naming and format for saving results as 4-byte sgl-values
 
@@ -76,6 +94,82 @@ def save_impedance_result( resultfile, Zresult ):
         fid.write( res.astype('>f4') )                # Impedance mag and phase
     return 0
 
+"""
+Read header of result file, not the data. Handles impedance results from
+'save_impedance_result', waveforms from 'waveform.save', and traces saved from
+LabVIEW, e.g. R&S ZVL, format as 'readtrace.m'.
+Returns struct with header fields, None if not stored in the file format.
+eoh is the file position where the header ends and the data start
+"""
+class trace_header:
+    def __init__( self ):
+        self.format = None     # 'impedance', 'waveform' or 'trace'
+        self.header = ''
+        self.time   = None     # Measurement time, impedance results only
+        self.nc     = 0        # Number of channels
+        self.x0     = None     # Start value and interval, waveforms and traces
+        self.dx     = None
+        self.dtr    = None     # Waveforms only, backward compatibility
+        self.eoh    = 0
+
+def read_trace_header( tracefile ):
+    hd = trace_header()
+    with open(tracefile, 'rb') as fid:
+        n_hd      = int( np.fromfile(fid, dtype='>i4', count=1)[0] )
+        hd.header = fid.read(n_hd).decode('utf-8', errors='replace')
+        if hd.header.startswith( '<Z_' ):             # 'save_impedance_result'
+            n_tm    = int( np.fromfile(fid, dtype='>i4', count=1)[0] )
+            hd.time = fid.read(n_tm).decode('utf-8', errors='replace')
+            hd.nc   = int( np.fromfile(fid, dtype='>u4', count=1)[0] )
+            hd.format = 'impedance'
+        elif hd.header.startswith( '<WFM_Python' ):   # 'waveform.save'
+            hd.nc   = int( np.fromfile(fid, dtype='>u4', count=1)[0] )
+            [ hd.x0, hd.dx, hd.dtr ] = np.fromfile(fid, dtype='>f8', count=3).tolist()
+            hd.format = 'waveform'
+        else:                                         # LabVIEW trace, 'readtrace.m'
+            hd.nc   = int( np.fromfile(fid, dtype='>u4', count=1)[0] )
+            [ hd.x0, hd.dx ] = np.fromfile(fid, dtype='>f8', count=2).tolist()
+            hd.format = 'trace'
+        hd.eoh = fid.tell()
+    return hd
+
+"""
+Load trace saved from LabVIEW, format as 'readtrace.m'.
+Returns header struct with data y as [npts, nc] and x-values of the points
+"""
+def load_trace( tracefile ):
+    trace = read_trace_header( tracefile )
+    with open(tracefile, 'rb') as fid:
+        fid.seek( trace.eoh )
+        y = np.fromfile(fid, dtype='>f4', count=-1).reshape((-1, trace.nc))
+    trace.y    = y.astype(float)
+    trace.npts = y.shape[0]
+    trace.x    = trace.x0 + trace.dx*np.arange( trace.npts )
+    trace.sourcefile = tracefile
+    return trace
+
+"""
+Load result of impedance measurement saved by 'save_impedance_result'.
+Returns struct with fields f and Z=[Zmag, Zphase], as saved
+"""
+class impedance_result:
+    def __init__( self, f=np.zeros(0), Z=np.zeros((0,2)) ):
+        self.f = f
+        self.Z = Z
+
+def load_impedance_result( resultfile ):
+    hd = read_trace_header( resultfile )
+    if hd.format != 'impedance':
+        raise ValueError( f'{resultfile} is not an impedance result' )
+    with open(resultfile, 'rb') as fid:
+        fid.seek( hd.eoh )
+        res = np.fromfile(fid, dtype='>f4', count=-1).reshape((-1, hd.nc))
+    result = impedance_result( res[:,0].astype(float), np.require( res[:,1:3].astype(float), requirements='C' ) )
+    result.header     = hd.header
+    result.time       = hd.time
+    result.sourcefile = resultfile
+    return result
+
 #%%
 """ waveform-class. Used to store traces sampled in time, one or several channels. 
     Compatible with previous versions used in e.g. LabVIEW and Matlab 
@@ -96,6 +190,7 @@ class waveform    :
         return np.linspace(self.t0, self.t0+self.dt*self.ns(), self.ns() )
     
     def plot(self, timeunit=""):
+        import matplotlib.pyplot as plt    # Imported when used, not needed for headless acquisition
         if timeunit == "us":
             mult = 1e6
         else:
@@ -129,6 +224,7 @@ class waveform    :
     
     
     def plotspectrum(self, timeunit="s", frequnit="Hz", fmax=None, normalise=True, scale="dB", padding=0 ):
+        import matplotlib.pyplot as plt
         plt.subplot(2,1,1)
         self.plot(timeunit)
         